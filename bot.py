@@ -1,17 +1,27 @@
 # bot.py
 import asyncio
 import os
+import heapq
 import json
 import time
+import re
 import sqlite3
+import tempfile
+import threading
+import zlib
+import hashlib
 from datetime import datetime
+from io import BytesIO
+from urllib.parse import urlsplit
 from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor
 import aiohttp
 import logging
 import backoff
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.error import BadRequest, RetryAfter
 
 # Попытка импортировать reportlab для PDF
 try:
@@ -36,6 +46,9 @@ except ImportError:
     REPORTLAB_AVAILABLE = False
     PDF_FONT_NAME = None
 
+# Markdown-разметка, вырезаемая из строк перед вставкой в PDF
+_MD_STRIP_RE = re.compile(r'[*`]')
+
 # Логирование
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -45,124 +58,495 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# orjson (C-реализация) заметно быстрее stdlib json, особенно на кириллице
+try:
+    import orjson
+
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    # Вариант без обратного decode: orjson отдаёт bytes — ровно то,
+    # что нужно для BLOB-колонок и zlib
+    _json_dumps_bytes = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    def _json_dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    _json_loads = json.loads
+
 DB_PATH = os.getenv('BOT_DB_PATH', 'bot_state.db')
+# fast: journal в памяти и без fsync — коммиты за микросекунды, но
+# незавершённое состояние теряется при падении процесса. Состояние бота
+# восстановимо повторным запуском исследования, поэтому это допустимый
+# компромисс для нагруженных инстансов.
+DB_DURABILITY = os.getenv('BOT_DB_DURABILITY', 'safe').lower()
 
 # -----------------------
 # Helpers for SQLite
 # -----------------------
+# Единое долгоживущее соединение: повторный connect() на каждый вызов
+# оплачивается установкой соединения и fsync на каждый commit.
+_conn: Optional[sqlite3.Connection] = None
+# Соединение делится между worker-потоками to_thread; писатели
+# сериализуются явно, чтобы транзакции не перемешивались
+_db_lock = threading.Lock()
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        # cached_statements выше дефолтных 100: все запросы бота парсятся однажды
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                                cached_statements=256)
+        cur = _conn.cursor()
+        if DB_DURABILITY == 'fast':
+            cur.execute('PRAGMA journal_mode=MEMORY')
+            cur.execute('PRAGMA synchronous=OFF')
+        else:
+            cur.execute('PRAGMA journal_mode=WAL')
+            cur.execute('PRAGMA synchronous=NORMAL')
+        cur.execute('PRAGMA busy_timeout=5000')
+        cur.execute('PRAGMA temp_store=MEMORY')
+        # Страницы читаем через mmap и держим крупный кэш (64 МБ): горячие
+        # выборки настроек и кэша поиска обходятся без syscall-ов чтения
+        cur.execute('PRAGMA mmap_size=268435456')
+        cur.execute('PRAGMA cache_size=-65536')
+    return _conn
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS researches (
-        chat_id INTEGER PRIMARY KEY,
-        topic TEXT,
-        data TEXT,
-        status TEXT,
-        start_time REAL
-    )
-    ''')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS user_settings (
-        chat_id INTEGER PRIMARY KEY,
-        settings_json TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_research_to_db(chat_id: int, topic: str, data: dict, status: str, start_time: float):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('REPLACE INTO researches (chat_id, topic, data, status, start_time) VALUES (?,?,?,?,?)',
-                (chat_id, topic, json.dumps(data, ensure_ascii=False), status, start_time))
-    conn.commit()
-    conn.close()
+    conn = _get_conn()
+    with _db_lock, conn:
+        # Автокоммит (isolation_level=None): без явного BEGIN каждый шаг
+        # миграции коммитится отдельно, и падение между RENAME и INSERT
+        # оставило бы данные в researches_legacy навсегда
+        conn.execute('BEGIN')
+        # Старые базы объявляли status как TEXT: из-за аффинности колонки
+        # числовые коды сохранялись строками '0'..'3'. Таблица крошечная
+        # (строка на чат), поэтому пересоздаём её с INTEGER и переносим
+        # строки, отображая легаси-значения в коды.
+        row = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='researches'"
+        ).fetchone()
+        legacy_researches = row is not None and 'status INTEGER' not in row[0]
+        if legacy_researches:
+            conn.execute('DROP INDEX IF EXISTS idx_researches_chat_status')
+            conn.execute('DROP INDEX IF EXISTS idx_researches_start_time')
+            conn.execute('ALTER TABLE researches RENAME TO researches_legacy')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS researches (
+            chat_id INTEGER PRIMARY KEY,
+            topic TEXT,
+            data TEXT,
+            status INTEGER,
+            start_time REAL
+        )
+        ''')
+        if legacy_researches:
+            conn.execute('''
+            INSERT INTO researches
+            SELECT chat_id, topic, data,
+                   CASE status
+                       WHEN 'running' THEN 0
+                       WHEN 'done' THEN 1
+                       WHEN 'cancelled' THEN 2
+                       WHEN 'error' THEN 3
+                       ELSE CAST(status AS INTEGER)
+                   END,
+                   start_time
+            FROM researches_legacy
+            ''')
+            conn.execute('DROP TABLE researches_legacy')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            chat_id INTEGER PRIMARY KEY,
+            settings_json TEXT
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS search_cache (
+            query_key TEXT PRIMARY KEY,
+            payload TEXT,
+            ts REAL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            chat_id INTEGER PRIMARY KEY,
+            md_text TEXT
+        )
+        ''')
+        # Индексы под будущую историю исследований: на пустой таблице они
+        # бесплатны, а миграции потом не потребуется
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_researches_chat_status ON researches(chat_id, status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_researches_start_time ON researches(start_time DESC)')
+        # Протухший кэш поиска выметаем на старте: TTL проверяется только
+        # при чтении, без чистки таблица росла бы неограниченно
+        conn.execute(SQL_PURGE_SEARCH, (time.time() - SEARCH_CACHE_TTL,))
+        conn.execute(f'PRAGMA user_version = {DB_SCHEMA_VERSION}')
+
+# Версия 2: колонка data хранит сжатый BLOB вместо JSON-текста
+# Версия 3: компактное состояние в researches, отчёты в таблице reports
+# Версия 4: status хранится числовым кодом, добавлены индексы
+DB_SCHEMA_VERSION = 4
+
+# Статусы в БД — INTEGER-код: байт на диске вместо строки и целочисленные
+# сравнения в будущих выборках; в памяти остаются читаемые строки
+STATUS_RUNNING, STATUS_DONE, STATUS_CANCELLED, STATUS_ERROR = 0, 1, 2, 3
+_STATUS_CODES = {
+    'running': STATUS_RUNNING,
+    'done': STATUS_DONE,
+    'cancelled': STATUS_CANCELLED,
+    'error': STATUS_ERROR,
+}
+
+# В researches попадает только компактное состояние — без настроек,
+# находок и текста отчёта
+PERSISTED_STATE_KEYS = ('topic', 'progress_message_id', 'start_time', 'status', 'completed_time')
+
+# SQL-константы: один литерал на запрос, чтобы кэш подготовленных
+# выражений соединения всегда попадал в одну и ту же строку
+SQL_SAVE_RESEARCH = 'REPLACE INTO researches (chat_id, topic, data, status, start_time) VALUES (?,?,?,?,?)'
+SQL_SAVE_REPORT = 'REPLACE INTO reports (chat_id, md_text) VALUES (?,?)'
+SQL_DELETE_RESEARCH = 'DELETE FROM researches WHERE chat_id = ?'
+SQL_LOAD_SETTINGS = 'SELECT settings_json FROM user_settings WHERE chat_id = ?'
+SQL_SAVE_SETTINGS = 'REPLACE INTO user_settings (chat_id, settings_json) VALUES (?,?)'
+SQL_LOAD_SEARCH = 'SELECT payload, ts FROM search_cache WHERE query_key = ?'
+SQL_SAVE_SEARCH = 'REPLACE INTO search_cache (query_key, payload, ts) VALUES (?,?,?)'
+SQL_PURGE_SEARCH = 'DELETE FROM search_cache WHERE ts < ?'
+
+def _encode_research_data(data: dict) -> bytes:
+    """Сжимает JSON перед записью: у готового исследования blob с находками
+    занимает десятки КБ, сжатие уменьшает объём записи в 3–10 раз."""
+    return zlib.compress(_json_dumps_bytes(data), 6)
+
+def save_research_to_db(chat_id: int, topic: str, metadata: dict, status: str, start_time: float):
+    """Терминальная запись исследования (cancelled/error): компактное
+    состояние, как и в save_research_done. UPDATE-шорткат по chat_id здесь
+    недопустим — строка в таблице принадлежит прошлому исследованию чата."""
+    state = {k: metadata[k] for k in PERSISTED_STATE_KEYS if k in metadata}
+    status_code = _STATUS_CODES.get(status, STATUS_ERROR)
+    conn = _get_conn()
+    with _db_lock, conn:
+        conn.execute(SQL_SAVE_RESEARCH,
+                     (chat_id, topic, _encode_research_data(state), status_code, start_time))
+
+def save_research_done(chat_id: int, topic: str, metadata: dict):
+    """Терминальная запись завершённого исследования одной транзакцией:
+    компактное состояние — в researches, полный Markdown-отчёт — в reports.
+    Полный blob метаданных (настройки, находки, отчёт) на диск не уходит."""
+    state = {k: metadata[k] for k in PERSISTED_STATE_KEYS if k in metadata}
+    conn = _get_conn()
+    with _db_lock, conn:
+        # isolation_level=None — автокоммит; транзакцию открываем явно,
+        # иначе обе записи коммитятся порознь и падение между ними
+        # оставит status=done без строки в reports
+        conn.execute('BEGIN')
+        conn.execute(SQL_SAVE_RESEARCH,
+                     (chat_id, topic, _encode_research_data(state), STATUS_DONE, metadata['start_time']))
+        conn.execute(SQL_SAVE_REPORT,
+                     (chat_id, metadata.get('full_report_text_md', '')))
 
 def delete_research_from_db(chat_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('DELETE FROM researches WHERE chat_id = ?', (chat_id,))
-    conn.commit()
-    conn.close()
+    conn = _get_conn()
+    with _db_lock, conn:
+        conn.execute(SQL_DELETE_RESEARCH, (chat_id,))
 
 def load_user_settings(chat_id: int) -> dict:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('SELECT settings_json FROM user_settings WHERE chat_id = ?', (chat_id,))
+    cur = _get_conn().execute(SQL_LOAD_SETTINGS, (chat_id,))
     row = cur.fetchone()
-    conn.close()
     if row:
-        return json.loads(row[0])
+        return _json_loads(row[0])
     return {}
 
+# Повторные запросы одной и той же темы (и пересекающиеся запросы внутри
+# одного исследования) отдаются из кэша без обращения к Serper.
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 24 * 3600))
+
+# Готовые отчёты кэшируются в памяти: повторный /research по той же теме
+# с тем же набором находок не тратит 10–30 с на вызовы Mistral.
+REPORT_CACHE_TTL = float(os.getenv('REPORT_CACHE_TTL', 3600))
+REPORT_CACHE_MAX = 512
+
+def _report_cache_key(topic: str, findings: List[dict]) -> tuple:
+    """Ключ кэша отчётов: нормализованная тема + дайджест набора находок."""
+    digest = hashlib.blake2b(
+        b'|'.join(sorted((kf.get('link', '') + kf.get('snippet', ''))[:256].encode('utf-8')
+                         for kf in findings)),
+        digest_size=16
+    ).hexdigest()
+    return (topic.strip().lower(), digest)
+
+def load_cached_search(query_key: str) -> Optional[dict]:
+    cur = _get_conn().execute(SQL_LOAD_SEARCH, (query_key,))
+    row = cur.fetchone()
+    if row and time.time() - row[1] < SEARCH_CACHE_TTL:
+        return _json_loads(row[0])
+    return None
+
+def save_cached_search(query_key: str, payload: dict):
+    now = time.time()
+    conn = _get_conn()
+    with _db_lock, conn:
+        conn.execute(SQL_SAVE_SEARCH, (query_key, _json_dumps(payload), now))
+        # Попутная чистка держит таблицу в размере рабочего окна TTL
+        # и на долгоживущих инстансах, которые не перезапускаются
+        conn.execute(SQL_PURGE_SEARCH, (now - SEARCH_CACHE_TTL,))
+
 def save_user_settings(chat_id: int, settings: dict):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('REPLACE INTO user_settings (chat_id, settings_json) VALUES (?,?)',
-                (chat_id, json.dumps(settings, ensure_ascii=False)))
-    conn.commit()
-    conn.close()
+    conn = _get_conn()
+    with _db_lock, conn:
+        conn.execute(SQL_SAVE_SETTINGS,
+                     (chat_id, _json_dumps(settings)))
 
 # -----------------------
 # API clients
 # -----------------------
+class AsyncRateLimiter:
+    """Асинхронный token bucket: запросы идут в темпе квоты API,
+    а не с фиксированными паузами «на всякий случай»."""
+    def __init__(self, max_rate: float, time_period: float = 1.0):
+        self.max_rate = float(max_rate)
+        self.time_period = time_period
+        self._configured_rate = float(max_rate)
+        self._tokens = float(max_rate)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def penalize(self):
+        """Сжимает квоту после 429: лучше замедлиться, чем крутить retry."""
+        self.max_rate = max(1.0, self.max_rate * 0.8)
+
+    def restore(self):
+        """Постепенно возвращает квоту к настроенной после успешных ответов."""
+        if self.max_rate < self._configured_rate:
+            self.max_rate = min(self._configured_rate, self.max_rate * 1.05)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.max_rate,
+                    self._tokens + (now - self._last_refill) * self.max_rate / self.time_period
+                )
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.time_period / self.max_rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+def _giveup_on_client_error(e: BaseException) -> bool:
+    """Не ретраить 4xx (кроме 429): повтор запроса с тем же ключом или телом
+    не исправит ошибку авторизации/валидации, а только сожжёт квоту."""
+    return (isinstance(e, aiohttp.ClientResponseError)
+            and 400 <= e.status < 500 and e.status != 429)
+
+async def _sleep_retry_after(e: Exception):
+    """Если сервер прислал Retry-After на 429 — ждём ровно столько,
+    прежде чем backoff повторит запрос."""
+    if not (isinstance(e, aiohttp.ClientResponseError) and e.status == 429):
+        return
+    retry_after = (e.headers or {}).get('Retry-After')
+    if retry_after is None:
+        return
+    try:
+        delay = min(float(retry_after), 30.0)
+    except ValueError:
+        return
+    await asyncio.sleep(delay)
+
+def _make_session() -> aiohttp.ClientSession:
+    """Создаёт сессию с keep-alive пулом — одно TLS-рукопожатие на хост, а не на запрос."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60)
+    )
+
 class SerperAPI:
     """Класс для работы с Serper API"""
-    def __init__(self, api_key: str, per_request_timeout: float = 15.0):
+    def __init__(self, api_key: str, per_request_timeout: float = 15.0,
+                 limiter: Optional[AsyncRateLimiter] = None):
         self.api_key = api_key
         self.base_url = "https://google.serper.dev"
         self.per_request_timeout = per_request_timeout
+        self._limiter = limiter
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Заголовки неизменны — собираем один раз
+        self._headers = {
+            'X-API-KEY': api_key,
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
 
-    @backoff.on_exception(backoff.expo, (aiohttp.ClientError, asyncio.TimeoutError), max_tries=3, factor=2)
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        # Лениво: сессии нужен работающий event loop
+        if self._session is None or self._session.closed:
+            self._session = _make_session()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    @backoff.on_exception(backoff.expo, (aiohttp.ClientError, asyncio.TimeoutError), max_tries=3, factor=2,
+                          giveup=_giveup_on_client_error)
     async def search(self, query: str, search_type: str = "search", num_results: int = 15) -> Dict[Any, Any]:
-        headers = {
-            'X-API-KEY': self.api_key,
-            'Content-Type': 'application/json'
-        }
-        payload = {
+        # num_results входит в ключ: ответ на 10 результатов не должен
+        # отдаваться за запрос на 20
+        query_key = f"{search_type}:{num_results}:{' '.join(query.lower().split())}"
+        cached = await asyncio.to_thread(load_cached_search, query_key)
+        if cached is not None:
+            return cached
+        # Сериализуем тело сами (_json_dumps = orjson при наличии) вместо
+        # stdlib-json внутри aiohttp
+        body = _json_dumps({
             'q': query,
             'num': num_results,
             'hl': 'ru',
             'gl': 'ru'
-        }
+        })
         try:
+            # Лимитер после проверки кэша: попадания не тратят квоту
+            if self._limiter is not None:
+                await self._limiter.acquire()
+            session = await self._ensure_session()
             timeout = aiohttp.ClientTimeout(total=self.per_request_timeout)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(f"{self.base_url}/{search_type}", headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        logger.error(f"Serper API error status: {response.status}")
-                        response.raise_for_status()
+            async with session.post(f"{self.base_url}/{search_type}", headers=self._headers, data=body, timeout=timeout) as response:
+                if response.status == 200:
+                    if self._limiter is not None:
+                        self._limiter.restore()
+                    # Читаем байты и разбираем сами: _json_loads = orjson
+                    data = _json_loads(await response.read())
+                    await asyncio.to_thread(save_cached_search, query_key, data)
+                    return data
+                else:
+                    logger.error(f"Serper API error status: {response.status}")
+                    response.raise_for_status()
         except Exception as e:
+            if (self._limiter is not None and isinstance(e, aiohttp.ClientResponseError)
+                    and e.status == 429):
+                self._limiter.penalize()
+            await _sleep_retry_after(e)
             logger.error(f"Ошибка Serper search: {e}")
             raise
 
+# Шаблон одной находки в промпте — поля гарантированы при инджесте
+_FINDING_FMT = (
+    "📌 **{title}**\n"
+    "📝 {snippet}\n"
+    "🔗 Источник [{idx}]: {link}"
+)
+
+# Системные промпты неизменны — собираются один раз при импорте
+_REPORT_SYSTEM_PROMPT = (
+    "Вы — эксперт-аналитик с глубокими знаниями в различных областях. "
+    "Создавайте структурированные, информативные отчёты на основе предоставленных данных. "
+    "Используйте академический стиль, избегайте рекламных фраз. "
+    "Обязательно указывайте ссылки на источники в формате [1], [2] и т.д. "
+    "Анализируйте тренды, выявляйте закономерности и делайте обоснованные выводы."
+)
+
+_MERGE_SYSTEM_PROMPT = (
+    "Вы — эксперт-аналитик. Вам даны несколько частичных отчётов по одной теме. "
+    "Объедините их в один связный структурированный отчёт: сохраните разделы, "
+    "уберите повторы и противоречия, сохраните ссылки на источники "
+    "в формате [1], [2] и т.д."
+)
+
 class MistralGenerator:
     """Класс для работы с Mistral API"""
-    def __init__(self, api_key: str, per_request_timeout: float = 45.0):
+    def __init__(self, api_key: str, per_request_timeout: float = 45.0,
+                 idle_timeout: float = 10.0,
+                 limiter: Optional[AsyncRateLimiter] = None):
         self.api_key = api_key
         self.base_url = "https://api.mistral.ai/v1/chat/completions"
         self.per_request_timeout = per_request_timeout
+        self.idle_timeout = idle_timeout
+        self._limiter = limiter
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = _make_session()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    @backoff.on_exception(backoff.expo, (aiohttp.ClientError, asyncio.TimeoutError), max_tries=3,
+                          giveup=_giveup_on_client_error)
+    async def _complete(self, system_prompt: str, user_prompt: str) -> str:
+        """Один вызов chat-completion к Mistral."""
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        body = _json_dumps({
+            "model": "mistral-large-latest",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": 0.3,
+            "max_tokens": 4000,
+        })
+        try:
+            if self._limiter is not None:
+                await self._limiter.acquire()
+            session = await self._ensure_session()
+            timeout = aiohttp.ClientTimeout(total=self.per_request_timeout)
+            async with session.post(self.base_url, headers=headers, data=body, timeout=timeout) as response:
+                response.raise_for_status()
+                if self._limiter is not None:
+                    self._limiter.restore()
+                # Тело читаем кусками со сторожевым idle-таймаутом: зависший
+                # поток обрывается через idle_timeout секунд тишины, а не по
+                # истечении полного дедлайна запроса
+                chunks = []
+                while True:
+                    chunk = await asyncio.wait_for(
+                        response.content.read(65536), timeout=self.idle_timeout
+                    )
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                data = _json_loads(b''.join(chunks))
+                if data and 'choices' in data and data['choices']:
+                    choice = data['choices'][0]
+                    if 'message' in choice and 'content' in choice['message']:
+                        return choice['message']['content']
+                    if 'text' in choice:
+                        return choice['text']
+                return "❌ Не удалось получить ответ от Mistral API."
+        except Exception as e:
+            if (self._limiter is not None and isinstance(e, aiohttp.ClientResponseError)
+                    and e.status == 429):
+                self._limiter.penalize()
+            await _sleep_retry_after(e)
+            logger.error(f"Ошибка Mistral _complete: {e}")
+            raise
 
-    @backoff.on_exception(backoff.expo, (aiohttp.ClientError, asyncio.TimeoutError), max_tries=3)
     async def generate_report(self, findings: List[Dict[str, str]], topic: str, system_instructions: Optional[str] = None) -> str:
-        findings_text = "\n\n".join([
-            f"📌 **{f['title']}**\n"
-            f"📝 {f['snippet']}\n"
-            f"🔗 Источник [{f.get('_source_index','')}]: {f.get('link','')}"
-            for f in findings[:20]  # Ограничиваем количество для лучшего качества
-        ])
-        
-        system_prompt = system_instructions or (
-            "Вы — эксперт-аналитик с глубокими знаниями в различных областях. "
-            "Создавайте структурированные, информативные отчёты на основе предоставленных данных. "
-            "Используйте академический стиль, избегайте рекламных фраз. "
-            "Обязательно указывайте ссылки на источники в формате [1], [2] и т.д. "
-            "Анализируйте тренды, выявляйте закономерности и делайте обоснованные выводы."
+        # Ограничиваем количество для лучшего качества; поля находок
+        # нормализованы при инджесте, поэтому обращаемся к ним напрямую
+        findings_text = "\n\n".join(
+            _FINDING_FMT.format(title=f['title'], snippet=f['snippet'],
+                                idx=f['_source_index'], link=f['link'])
+            for f in findings[:20]
         )
         
+        system_prompt = system_instructions or _REPORT_SYSTEM_PROMPT
+        
         user_prompt = f"""
 Создайте подробный аналитический отчёт по теме: "{topic}"
 
@@ -183,37 +567,216 @@ class MistralGenerator:
 - Выделяйте ключевые моменты
 - Делайте выводы на основе фактов
 """
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        payload = {
-            "model": "mistral-large-latest",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.3,
-            "max_tokens": 4000,
-        }
+
+        return await self._complete(system_prompt, user_prompt)
+
+    async def merge_reports(self, partial_reports: List[str], topic: str) -> str:
+        """Сводит частичные отчёты по группам находок в один итоговый."""
+        joined = "\n\n=== Частичный отчёт ===\n\n".join(partial_reports)
+        user_prompt = f'Объедините частичные отчёты по теме: "{topic}"\n\n{joined}'
+        return await self._complete(_MERGE_SYSTEM_PROMPT, user_prompt)
+
+# -----------------------
+# PDF rendering
+# -----------------------
+# Стили неизменны между рендерами — собираем таблицу один раз при импорте
+# (в каждом воркере пула процессов), а не на каждый отчёт
+# Итоговое имя шрифта зависит только от констант модуля
+_PDF_FONT = PDF_FONT_NAME or 'Helvetica'
+
+if REPORTLAB_AVAILABLE:
+    _PDF_STYLES = getSampleStyleSheet()
+    for _style_name in ('Title', 'Heading1', 'Normal'):
+        _PDF_STYLES[_style_name].fontName = _PDF_FONT
+else:
+    _PDF_STYLES = None
+
+# Модульная функция (не метод): должна быть picklable для пула процессов;
+# шрифт регистрируется при импорте модуля в каждом воркере
+def _render_pdf_file(title: str, md_text: str) -> str:
+    """Создаёт улучшенный PDF с поддержкой кириллицы.
+
+    Пишет сразу во временный файл и возвращает путь: держать весь PDF
+    в памяти (и гонять байты между процессами пула) не нужно — загрузка
+    в Telegram читает файл потоково."""
+    fd, pdf_path = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    doc = SimpleDocTemplate(pdf_path, pagesize=A4, topMargin=1*inch)
+
+    title_style = _PDF_STYLES['Title']
+    heading_style = _PDF_STYLES['Heading1']
+    normal_style = _PDF_STYLES['Normal']
+
+    story = []
+
+    # Заголовок
+    story.append(Paragraph(f"Исследовательский отчёт: {title}", title_style))
+    story.append(Spacer(1, 0.2*inch))
+
+    # Подряд идущие обычные строки склеиваются в один Paragraph:
+    # в разы меньше flowables — doc.build доминирует в стоимости рендера
+    buf: List[str] = []
+
+    def flush_buf():
+        if not buf:
+            return
         try:
-            timeout = aiohttp.ClientTimeout(total=self.per_request_timeout)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(self.base_url, headers=headers, json=payload) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    if data and 'choices' in data and data['choices']:
-                        choice = data['choices'][0]
-                        if 'message' in choice and 'content' in choice['message']:
-                            return choice['message']['content']
-                        if 'text' in choice:
-                            return choice['text']
-                    return "❌ Не удалось получить ответ от Mistral API."
+            story.append(Paragraph("<br/>".join(buf), normal_style))
         except Exception as e:
-            logger.error(f"Ошибка Mistral generate_report: {e}")
-            raise
+            # Если не удалось добавить абзац, пропускаем его
+            logger.debug(f"Пропущен абзац в PDF: {e}")
+        buf.clear()
+
+    for line in md_text.split('\n'):
+        line = line.strip()
+        if not line:
+            flush_buf()
+        elif line.startswith('# '):
+            flush_buf()
+            story.append(Paragraph(line[2:], title_style))
+        elif line.startswith('## '):
+            flush_buf()
+            story.append(Paragraph(line[3:], heading_style))
+        elif line.startswith('### '):
+            flush_buf()
+            story.append(Paragraph(line[4:], heading_style))
+        else:
+            # Убираем markdown разметку для PDF
+            clean_line = _MD_STRIP_RE.sub('', line)
+            if clean_line:
+                buf.append(clean_line)
+    flush_buf()
+
+    try:
+        doc.build(story)
+    except Exception:
+        # Вызвавший удаляет файл только после успешной отправки — при
+        # ошибке рендера (например, LayoutError) чистим за собой сами
+        os.unlink(pdf_path)
+        raise
+    return pdf_path
+
+# -----------------------
+# Static reply texts
+# -----------------------
+# Неизменные HTML-ответы собираются один раз на импорт, а не на каждый апдейт
+WELCOME_TEXT = (
+    "🔬 <b>Research Bot — Ваш персональный аналитик</b>\n\n"
+    "🎯 <b>Что я умею:</b>\n"
+    "• Провожу глубокие исследования по любой теме\n"
+    "• Анализирую актуальную информацию из интернета\n"
+    "• Создаю структурированные отчёты с источниками\n"
+    "• Генерирую PDF-документы\n\n"
+    "📋 <b>Основные команды:</b>\n"
+    "🔍 /research &lt;тема&gt; — начать исследование\n"
+    "📊 /status — статус текущего исследования\n"
+    "❌ /cancel — отменить исследование\n"
+    "⚙️ /settings — настройки бота\n"
+    "📚 /sources — список источников\n"
+    "❓ /help — подробная справка\n\n"
+    "💡 <b>Просто отправьте мне тему для исследования!</b>"
+)
+
+HELP_TEXT = (
+    "📖 <b>Подробная справка по Research Bot</b>\n\n"
+    "🚀 <b>Быстрый старт:</b>\n"
+    "1️⃣ Отправьте тему: <code>Искусственный интеллект в медицине</code>\n"
+    "2️⃣ Следите за прогрессом в реальном времени\n"
+    "3️⃣ Получите готовый отчёт в Markdown и PDF\n\n"
+    "⚙️ <b>Настройки:</b>\n"
+    "• <code>/settings sources 25</code> — количество источников (1-50)\n"
+    "• <code>/settings depth on</code> — глубокий анализ (on/off)\n"
+    "• <code>/settings lang en</code> — язык отчёта (ru/en)\n\n"
+    "📊 <b>Дополнительные команды:</b>\n"
+    "• <code>/status</code> — текущий прогресс\n"
+    "• <code>/sources</code> — список найденных источников\n"
+    "• <code>/cancel</code> — остановить исследование\n\n"
+    "💡 <b>Советы:</b>\n"
+    "• Формулируйте тему конкретно\n"
+    "• Используйте ключевые слова\n"
+    "• Один запрос = одно исследование"
+)
+
+NO_ACTIVE_RESEARCH_TEXT = "📭 <b>Нет активных исследований</b>\n\n💡 Отправьте тему для начала нового исследования"
+
+# Шаблоны поисковых запросов — собираются один раз на импорт
+BASE_QUERY_TEMPLATES = [
+    "{topic} обзор 2025",
+    "{topic} исследование анализ",
+    "{topic} статистика данные тренды",
+    "{topic} развитие перспективы",
+    "{topic} проблемы вызовы решения",
+    "{topic} инновации технологии",
+    "{topic} рынок прогнозы",
+    "{topic} экспертное мнение аналитика"
+]
+
+DEEP_QUERY_TEMPLATES = [
+    "{topic} case study практические примеры",
+    "{topic} лучшие практики опыт",
+    "{topic} исследования университетов",
+    "{topic} отчёты консалтинговых компаний",
+    "{topic} белые книги whitepaper",
+    "{topic} научные публикации"
+]
+
+# Категория темы определяется пересечением токенов с таблицей —
+# одна проверка вместо цепочки substring-сканов по всей теме
+CATEGORY_QUERY_TEMPLATES = [
+    (frozenset({'технология', 'технологии', 'tech', 'ии', 'ai', 'блокчейн',
+                'искусственный', 'интеллект'}),
+     ["{topic} внедрение применение", "{topic} стартапы компании лидеры"]),
+    (frozenset({'медицина', 'здоровье', 'лечение'}),
+     ["{topic} клинические исследования", "{topic} эффективность результаты"]),
+    (frozenset({'экономика', 'финансы', 'бизнес'}),
+     ["{topic} экономический эффект", "{topic} инвестиции рынок"]),
+]
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Повторяющиеся куски Markdown-отчёта: append по ссылке на интернированную
+# строку вместо новой аллокации на каждую вставку
+MD_SEP = "---\n\n"
+MD_H_REPORT = "## 🎯 Аналитический отчёт\n\n"
+MD_H_FINDINGS = "## 🔍 Детальные находки\n\n"
+MD_H_SOURCES = "## 📚 Источники\n\n"
+MD_H_META = "## ℹ️ Информация о создании\n\n"
+
+# Все 21 вариант прогресс-бара (шаг 5%) — вместо двух умножений строк
+# на каждую правку прогресса
+_PROGRESS_BARS = ["🟩" * b + "⬜" * (20 - b) for b in range(21)]
+
+def _canonical_link(link: str) -> str:
+    """Канонизирует URL для дедупликации: обрезает query и fragment,
+    чтобы тривиально различающиеся ссылки (utm-метки и т.п.) схлопывались."""
+    if not link:
+        return ''
+    parts = urlsplit(link)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}".rstrip('/')
+
+def _score_finding(topic_tokens: frozenset, title: str, snippet: str) -> float:
+    """Релевантность находки: доля токенов темы, встреченных в заголовке и
+    сниппете, с небольшим бонусом за информативную длину сниппета. Вся
+    пословная работа выполняется C-реализациями re и set."""
+    text_tokens = set(_TOKEN_RE.findall((title + ' ' + snippet).lower()))
+    if not topic_tokens:
+        return min(len(snippet), 300) / 300.0
+    overlap = len(topic_tokens & text_tokens) / len(topic_tokens)
+    return overlap * 10.0 + min(len(snippet), 300) / 300.0
+
+STATUS_EMOJI = {
+    'running': '🔄',
+    'done': '✅',
+    'cancelled': '❌',
+    'error': '⚠️'
+}
+
+STATUS_TEMPLATE = (
+    "{emoji} <b>Статус исследования</b>\n\n"
+    "📋 <b>Тема:</b> {topic}\n"
+    "⏱ <b>Время:</b> {elapsed}\n"
+    "📊 <b>Статус:</b> {status}"
+)
 
 # -----------------------
 # Main bot
@@ -225,29 +788,60 @@ class ResearchBot:
         self.mistral_api_key = os.getenv('MISTRAL_API_KEY')
         self.max_results_default = int(os.getenv('MAX_RESULTS_PER_QUERY', 20))
         self.max_concurrent = int(os.getenv('MAX_CONCURRENT_SEARCHES', 4))
+        self.llm_chunk_size = int(os.getenv('LLM_CHUNK_SIZE', 8))
+        self.llm_max_concurrent = int(os.getenv('MISTRAL_MAX_CONCURRENT', 3))
         self.deep_analysis_default = os.getenv('DEEP_ANALYSIS_ENABLED', 'true').lower() == 'true'
         self.default_lang = os.getenv('DEFAULT_LANG', 'ru')
 
-        self.serper = SerperAPI(self.serper_api_key, per_request_timeout=float(os.getenv('SERPER_REQ_TIMEOUT', 15.0)))
-        self.llm_generator = MistralGenerator(self.mistral_api_key, per_request_timeout=float(os.getenv('MISTRAL_REQ_TIMEOUT', 45.0)))
+        self._serper_limiter = AsyncRateLimiter(max_rate=float(os.getenv('SERPER_MAX_RPS', 10)), time_period=1.0)
+        self._mistral_limiter = AsyncRateLimiter(max_rate=float(os.getenv('MISTRAL_MAX_RPM', 60)), time_period=60.0)
+        self.serper = SerperAPI(self.serper_api_key,
+                                per_request_timeout=float(os.getenv('SERPER_REQ_TIMEOUT', 15.0)),
+                                limiter=self._serper_limiter)
+        self.llm_generator = MistralGenerator(self.mistral_api_key,
+                                              per_request_timeout=float(os.getenv('MISTRAL_REQ_TIMEOUT', 45.0)),
+                                              idle_timeout=float(os.getenv('MISTRAL_IDLE_TIMEOUT', 10.0)),
+                                              limiter=self._mistral_limiter)
+
+        # Рендер PDF — чистый CPU: пул процессов масштабирует его по ядрам,
+        # не трогая event loop
+        self._pdf_pool = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1)) if REPORTLAB_AVAILABLE else None
 
         self._tasks: Dict[int, asyncio.Task] = {}
         self.active_researches: Dict[int, Dict[str, Any]] = {}
+        # Настройки — самая частая операция с БД; держим их в памяти
+        self._settings_cache: Dict[int, dict] = {}
+        # Single-flight для правок прогресса: по одной на чат
+        self._edit_locks: Dict[int, asyncio.Lock] = {}
+        # Кэш готовых отчётов: (тема, дайджест находок) -> (ts, текст)
+        self._report_cache: Dict[tuple, tuple] = {}
+        # Момент последней успешной правки прогресса по чату
+        self._last_edit: Dict[int, float] = {}
 
         init_db()
 
     # ---------- Utilities ----------
-    def _get_user_settings(self, chat_id: int) -> dict:
-        settings = load_user_settings(chat_id)
+    async def _get_user_settings(self, chat_id: int) -> dict:
+        cached = self._settings_cache.get(chat_id)
+        if cached is not None:
+            return cached
+        # sqlite3 блокирует поток на время запроса — уводим в worker thread,
+        # чтобы event loop продолжал обслуживать другие чаты
+        settings = await asyncio.to_thread(load_user_settings, chat_id)
         if not settings:
             settings = {
                 'max_results': self.max_results_default,
                 'deep_analysis': self.deep_analysis_default,
                 'lang': self.default_lang
             }
-            save_user_settings(chat_id, settings)
+            await asyncio.to_thread(save_user_settings, chat_id, settings)
+        self._settings_cache[chat_id] = settings
         return settings
 
+    async def _save_user_settings(self, chat_id: int, settings: dict):
+        self._settings_cache[chat_id] = settings
+        await asyncio.to_thread(save_user_settings, chat_id, settings)
+
     def _format_time(self, seconds: int) -> str:
         """Форматирование времени в читаемый вид"""
         if seconds < 60:
@@ -261,50 +855,15 @@ class ResearchBot:
 
     # ---------- Bot handlers ----------
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        welcome_text = (
-    "🔬 <b>Research Bot — Ваш персональный аналитик</b>\n\n"
-    "🎯 <b>Что я умею:</b>\n"
-    "• Провожу глубокие исследования по любой теме\n"
-    "• Анализирую актуальную информацию из интернета\n"
-    "• Создаю структурированные отчёты с источниками\n"
-    "• Генерирую PDF-документы\n\n"
-    "📋 <b>Основные команды:</b>\n"
-    "🔍 /research &lt;тема&gt; — начать исследование\n"
-    "📊 /status — статус текущего исследования\n"
-    "❌ /cancel — отменить исследование\n"
-    "⚙️ /settings — настройки бота\n"
-    "📚 /sources — список источников\n"
-    "❓ /help — подробная справка\n\n"
-    "💡 <b>Просто отправьте мне тему для исследования!</b>"
-        )
-        await update.message.reply_text(welcome_text, parse_mode='HTML')
+        await update.message.reply_text(WELCOME_TEXT, parse_mode='HTML')
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        help_text = (
-            "📖 <b>Подробная справка по Research Bot</b>\n\n"
-            "🚀 <b>Быстрый старт:</b>\n"
-            "1️⃣ Отправьте тему: <code>Искусственный интеллект в медицине</code>\n"
-            "2️⃣ Следите за прогрессом в реальном времени\n"
-            "3️⃣ Получите готовый отчёт в Markdown и PDF\n\n"
-            "⚙️ <b>Настройки:</b>\n"
-            "• <code>/settings sources 25</code> — количество источников (1-50)\n"
-            "• <code>/settings depth on</code> — глубокий анализ (on/off)\n"
-            "• <code>/settings lang en</code> — язык отчёта (ru/en)\n\n"
-            "📊 <b>Дополнительные команды:</b>\n"
-            "• <code>/status</code> — текущий прогресс\n"
-            "• <code>/sources</code> — список найденных источников\n"
-            "• <code>/cancel</code> — остановить исследование\n\n"
-            "💡 <b>Советы:</b>\n"
-            "• Формулируйте тему конкретно\n"
-            "• Используйте ключевые слова\n"
-            "• Один запрос = одно исследование"
-        )
-        await update.message.reply_text(help_text, parse_mode='HTML')
+        await update.message.reply_text(HELP_TEXT, parse_mode='HTML')
 
     async def settings_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         args = context.args
-        current = self._get_user_settings(chat_id)
+        current = await self._get_user_settings(chat_id)
         
         if not args:
             depth_status = "включён" if current['deep_analysis'] else "выключен"
@@ -332,7 +891,7 @@ class ResearchBot:
                         await update.message.reply_text("❌ Количество источников должно быть от 1 до 50")
                         return
                     current['max_results'] = val
-                    save_user_settings(chat_id, current)
+                    await self._save_user_settings(chat_id, current)
                     await update.message.reply_text(f"✅ <b>Количество источников:</b> {val}", parse_mode='HTML')
                 except ValueError:
                     await update.message.reply_text("❌ Укажите число от 1 до 50\n<b>Пример:</b> <code>/settings sources 25</code>", parse_mode='HTML')
@@ -347,14 +906,14 @@ class ResearchBot:
                 else:
                     await update.message.reply_text("❌ Используйте <code>on</code> или <code>off</code>\n<b>Пример:</b> <code>/settings depth on</code>", parse_mode='HTML')
                     return
-                save_user_settings(chat_id, current)
+                await self._save_user_settings(chat_id, current)
                 
             elif key in ['lang', 'language']:
                 if value not in ['ru', 'en']:
                     await update.message.reply_text("❌ Поддерживаемые языки: <code>ru</code>, <code>en</code>\n<b>Пример:</b> <code>/settings lang en</code>", parse_mode='HTML')
                     return
                 current['lang'] = value
-                save_user_settings(chat_id, current)
+                await self._save_user_settings(chat_id, current)
                 await update.message.reply_text(f"✅ <b>Язык отчёта:</b> {value.upper()}", parse_mode='HTML')
             else:
                 await update.message.reply_text("❌ Неизвестная настройка. Используйте: <code>sources</code>, <code>depth</code>, <code>lang</code>", parse_mode='HTML')
@@ -391,21 +950,14 @@ class ResearchBot:
         if chat_id in self.active_researches:
             r = self.active_researches[chat_id]
             elapsed = int(time.time() - r['start_time'])
-            status_emoji = {
-                'running': '🔄',
-                'done': '✅',
-                'cancelled': '❌',
-                'error': '⚠️'
-            }
-            emoji = status_emoji.get(r.get('status', 'running'), '🔄')
-            text = (
-                f"{emoji} <b>Статус исследования</b>\n\n"
-                f"📋 <b>Тема:</b> {r['topic']}\n"
-                f"⏱ <b>Время:</b> {self._format_time(elapsed)}\n"
-                f"📊 <b>Статус:</b> {r.get('status', 'выполняется')}"
-            )
+            text = STATUS_TEMPLATE.format_map({
+                'emoji': STATUS_EMOJI.get(r.get('status', 'running'), '🔄'),
+                'topic': r['topic'],
+                'elapsed': self._format_time(elapsed),
+                'status': r.get('status', 'выполняется')
+            })
         else:
-            text = "📭 <b>Нет активных исследований</b>\n\n💡 Отправьте тему для начала нового исследования"
+            text = NO_ACTIVE_RESEARCH_TEXT
         await update.message.reply_text(text, parse_mode='HTML')
 
     async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -415,13 +967,6 @@ class ResearchBot:
             task.cancel()
             if chat_id in self.active_researches:
                 self.active_researches[chat_id]['status'] = 'cancelled'
-                save_research_to_db(
-                    chat_id, 
-                    self.active_researches[chat_id]['topic'], 
-                    self.active_researches[chat_id], 
-                    'cancelled', 
-                    self.active_researches[chat_id]['start_time']
-                )
             del self._tasks[chat_id]
             await update.message.reply_text("❌ <b>Исследование отменено</b>", parse_mode='HTML')
         else:
@@ -443,18 +988,20 @@ class ResearchBot:
             await update.message.reply_text("📭 <b>Источники пока не найдены</b>", parse_mode='HTML')
             return
             
-        out_lines = [f"📚 <b>Источники по теме:</b> {research['topic']}\n"]
+        # Пишем сразу в байтовый буфер — без промежуточного списка строк
+        # и без второй копии текста при encode
+        buf = BytesIO()
+        buf.write(f"📚 Источники по теме: {research['topic']}\n\n".encode('utf-8'))
         for idx, s in enumerate(sources[:30], start=1):  # Ограничиваем до 30 источников
             title = s.get('title', 'Без названия')[:80]
             link = s.get('link', '')
-            out_lines.append(f"{idx}. {title}\n🔗 {link}\n")
-            
-        txt = "\n".join(out_lines)
+            buf.write(f"{idx}. {title}\n🔗 {link}\n\n".encode('utf-8'))
+        buf.seek(0)
+
         fname = f"sources_{research['topic'][:20].replace(' ', '_')}_{int(time.time())}.txt"
-        
         await update.effective_chat.send_document(
-            document=txt.encode('utf-8'), 
-            filename=fname, 
+            document=buf,
+            filename=fname,
             caption="📚 <b>Список источников исследования</b>",
             parse_mode='HTML'
         )
@@ -470,7 +1017,7 @@ class ResearchBot:
             )
             return
 
-        settings = self._get_user_settings(chat_id)
+        settings = await self._get_user_settings(chat_id)
         
         start_msg = await update.message.reply_text(
             f"🔬 <b>Запускаю исследование</b>\n\n"
@@ -490,7 +1037,8 @@ class ResearchBot:
             'settings': settings
         }
         self.active_researches[chat_id] = metadata
-        save_research_to_db(chat_id, topic, metadata, 'running', metadata['start_time'])
+        # В БД ничего не пишем: промежуточное состояние живёт в памяти,
+        # терминальное персистит _research_task_runner в finally
 
         task = asyncio.create_task(self._research_task_runner(chat_id, topic, progress_message_id, settings))
         self._tasks[chat_id] = task
@@ -508,10 +1056,6 @@ class ResearchBot:
                 'full_report_text_md': md_text,
                 'sources_list': results['sources_list']
             })
-            save_research_to_db(
-                chat_id, topic, self.active_researches[chat_id], 'done', 
-                self.active_researches[chat_id]['start_time']
-            )
 
             # Финальное сообщение о завершении
             completion_time = self._format_time(self.active_researches[chat_id]['completed_time'])
@@ -531,55 +1075,30 @@ class ResearchBot:
             except Exception as e:
                 logger.warning(f"Не удалось обновить сообщение о прогрессе: {e}")
 
-            # Отправка отчёта
-            md_filename = f"report_{topic.replace(' ','_')[:40]}_{int(time.time())}.md"
-            await self.application.bot.send_document(
-                chat_id=chat_id,
-                document=md_text.encode('utf-8'),
-                filename=md_filename,
-                caption=(
-                    f"📋 <b>Исследовательский отчёт</b>\n\n"
-                    f"📝 <b>Тема:</b> {topic}\n"
-                    f"📊 <b>Источников:</b> {len(results['sources_list'])}\n"
-                    f"⏱ <b>Время:</b> {completion_time}"
-                ),
-                parse_mode='HTML'
+            # Markdown и PDF независимы: загрузка MD идёт параллельно
+            # с рендером и загрузкой PDF
+            md_result, _ = await asyncio.gather(
+                self._send_md_report(chat_id, topic, md_text, completion_time, len(results['sources_list'])),
+                self._send_pdf_report(chat_id, topic, md_text),
+                return_exceptions=True
             )
-
-            # Отправка PDF если доступно
-            if REPORTLAB_AVAILABLE:
+            # _send_pdf_report сам сообщает о своих ошибках; провал загрузки
+            # MD без этого остался бы молчаливым
+            if isinstance(md_result, BaseException):
+                logger.error(f"Не удалось отправить Markdown-отчёт: {md_result}")
                 try:
-                    pdf_bytes = self._render_pdf_bytes(topic, md_text)
-                    pdf_filename = f"report_{topic.replace(' ','_')[:40]}_{int(time.time())}.pdf"
-                    await self.application.bot.send_document(
-                        chat_id=chat_id,
-                        document=pdf_bytes,
-                        filename=pdf_filename,
-                        caption="📄 <b>PDF версия отчёта</b>",
-                        parse_mode='HTML'
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка генерации PDF: {e}")
                     await self.application.bot.send_message(
                         chat_id=chat_id,
-                        text="⚠️ <b>Не удалось создать PDF версию</b>\nИспользуйте Markdown файл",
+                        text="⚠️ <b>Не удалось отправить файл отчёта</b>\n\nПопробуйте запустить исследование ещё раз.",
                         parse_mode='HTML'
                     )
-            else:
-                await self.application.bot.send_message(
-                    chat_id=chat_id,
-                    text="ℹ️ <b>PDF генерация недоступна</b>\nУстановите библиотеку reportlab для создания PDF",
-                    parse_mode='HTML'
-                )
+                except Exception:
+                    pass
 
         except asyncio.CancelledError:
             logger.info(f"Research task cancelled for {chat_id}")
             if chat_id in self.active_researches:
                 self.active_researches[chat_id]['status'] = 'cancelled'
-                save_research_to_db(
-                    chat_id, topic, self.active_researches[chat_id], 'cancelled', 
-                    self.active_researches[chat_id]['start_time']
-                )
             try:
                 await self.application.bot.send_message(
                     chat_id=chat_id, 
@@ -600,14 +1119,71 @@ class ResearchBot:
                 pass
             if chat_id in self.active_researches:
                 self.active_researches[chat_id]['status'] = 'error'
-                save_research_to_db(
-                    chat_id, topic, self.active_researches[chat_id], 'error', 
-                    self.active_researches[chat_id]['start_time']
-                )
         finally:
+            # Единственная запись в БД за весь прогон: промежуточные смены
+            # статуса живут в active_researches, на диск уходит только
+            # терминальное состояние.
+            metadata = self.active_researches.get(chat_id)
+            if metadata is not None:
+                status = metadata.get('status', 'error')
+                if status == 'done':
+                    await asyncio.to_thread(save_research_done, chat_id, topic, metadata)
+                else:
+                    # cancelled/error: полная терминальная запись — стартовой
+                    # записи больше нет, обновлять нечего
+                    await asyncio.to_thread(
+                        save_research_to_db, chat_id, topic, metadata, status,
+                        metadata['start_time']
+                    )
             if chat_id in self._tasks:
                 del self._tasks[chat_id]
 
+    async def _send_md_report(self, chat_id: int, topic: str, md_text: str, completion_time: str, sources_count: int):
+        md_filename = f"report_{topic.replace(' ','_')[:40]}_{int(time.time())}.md"
+        await self.application.bot.send_document(
+            chat_id=chat_id,
+            document=md_text.encode('utf-8'),
+            filename=md_filename,
+            caption=(
+                f"📋 <b>Исследовательский отчёт</b>\n\n"
+                f"📝 <b>Тема:</b> {topic}\n"
+                f"📊 <b>Источников:</b> {sources_count}\n"
+                f"⏱ <b>Время:</b> {completion_time}"
+            ),
+            parse_mode='HTML'
+        )
+
+    async def _send_pdf_report(self, chat_id: int, topic: str, md_text: str):
+        if not REPORTLAB_AVAILABLE:
+            await self.application.bot.send_message(
+                chat_id=chat_id,
+                text="ℹ️ <b>PDF генерация недоступна</b>\nУстановите библиотеку reportlab для создания PDF",
+                parse_mode='HTML'
+            )
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            pdf_path = await loop.run_in_executor(self._pdf_pool, _render_pdf_file, topic, md_text)
+            pdf_filename = f"report_{topic.replace(' ','_')[:40]}_{int(time.time())}.pdf"
+            try:
+                with open(pdf_path, 'rb') as pdf_file:
+                    await self.application.bot.send_document(
+                        chat_id=chat_id,
+                        document=pdf_file,
+                        filename=pdf_filename,
+                        caption="📄 <b>PDF версия отчёта</b>",
+                        parse_mode='HTML'
+                    )
+            finally:
+                os.unlink(pdf_path)
+        except Exception as e:
+            logger.error(f"Ошибка генерации PDF: {e}")
+            await self.application.bot.send_message(
+                chat_id=chat_id,
+                text="⚠️ <b>Не удалось создать PDF версию</b>\nИспользуйте Markdown файл",
+                parse_mode='HTML'
+            )
+
     async def _run_research_logic(self, topic: str, chat_id: int, progress_message_id: int, settings: dict) -> dict:
         results = {
             'topic': topic,
@@ -619,17 +1195,26 @@ class ResearchBot:
         
         # Генерируем улучшенные поисковые запросы
         queries = await self.generate_search_queries(topic, settings)
+        # Шаблоны могут дать совпадающие запросы — каждый уходит в Serper
+        # только один раз, порядок сохраняем
+        queries = list(dict.fromkeys(queries))
         total_steps = len(queries) + 3
         current_step = 0
 
         semaphore = asyncio.Semaphore(self.max_concurrent)
+        seen_links: set = set()
+        topic_tokens = frozenset(_TOKEN_RE.findall(topic.lower()))
+        # Локальные привязки для горячего цикла: LOAD_FAST вместо
+        # повторных обращений к dict/атрибутам на каждый запрос
+        max_results = settings['max_results']
+        serper = self.serper
 
         async def search_with_semaphore(query):
             async with semaphore:
                 try:
                     resp = await asyncio.wait_for(
-                        self.serper.search(query, num_results=settings['max_results']), 
-                        timeout=self.serper.per_request_timeout + 5
+                        serper.search(query, num_results=max_results),
+                        timeout=serper.per_request_timeout + 5
                     )
                     return resp
                 except asyncio.TimeoutError:
@@ -639,41 +1224,53 @@ class ResearchBot:
                     logger.error(f"Ошибка поиска для запроса {query}: {e}")
                     return {}
 
-        # Выполняем поиски батчами
-        for i in range(0, len(queries), self.max_concurrent):
-            batch = queries[i:i + self.max_concurrent]
-            tasks = [asyncio.create_task(search_with_semaphore(q)) for q in batch]
-            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            for j, res in enumerate(batch_results):
+        async def search_one(query):
+            return query, await search_with_semaphore(query)
+
+        # Все поиски стартуют сразу (семафор ограничивает параллелизм),
+        # результаты обрабатываются по мере готовности — медленный запрос
+        # не тормозит остальные.
+        tasks = [asyncio.create_task(search_one(q)) for q in queries]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                query, res = await finished
                 current_step += 1
-                query_name = batch[j][:50] + "..." if len(batch[j]) > 50 else batch[j]
+                query_name = query[:50] + "..." if len(query) > 50 else query
                 await self._update_progress(
-                    chat_id, progress_message_id, current_step, total_steps, 
+                    chat_id, progress_message_id, current_step, total_steps,
                     f"🔍 Поиск: {query_name}"
                 )
-                
+
                 if isinstance(res, dict) and res.get('organic'):
-                    r_items = res.get('organic', [])[:settings['max_results']]
-                    results['searches'].append({'query': batch[j], 'results': r_items})
-                    
+                    r_items = res.get('organic', [])[:max_results]
+                    results['searches'].append({'query': query, 'results': r_items})
+
                     for item in r_items:
-                        if item.get('snippet') and len(item.get('snippet', '')) > 20:
-                            src_index = len(results['sources']) + 1
-                            results['key_findings'].append({
-                                'title': item.get('title', 'Без названия'),
-                                'snippet': item.get('snippet', ''),
-                                'link': item.get('link', ''),
-                                '_source_index': src_index
-                            })
-                            results['sources'].append({
-                                'title': item.get('title', 'Без названия'), 
-                                'link': item.get('link', '')
-                            })
-                
-                await asyncio.sleep(0.3)  # Небольшая пауза между запросами
-            
-            await asyncio.sleep(1.5)  # Пауза между батчами
+                        snippet = item.get('snippet', '')
+                        if len(snippet) <= 30:
+                            continue
+                        # Дедупликация на вставке: ключ — канонизированный URL
+                        link = item.get('link', '')
+                        link_key = _canonical_link(link)
+                        if not link_key or link_key in seen_links:
+                            continue
+                        seen_links.add(link_key)
+                        src_index = len(seen_links)
+                        title = item.get('title', 'Без названия')
+                        results['key_findings'].append({
+                            'title': title,
+                            'snippet': snippet,
+                            'link': link,
+                            '_source_index': src_index,
+                            '_score': _score_finding(topic_tokens, title, snippet)
+                        })
+                        results['sources'].append({'title': title, 'link': link})
+        finally:
+            # as_completed не отменяет участников: при /cancel или ошибке
+            # в цикле оставшиеся поиски гасим сами, чтобы не жечь квоту
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
 
         # Фильтруем и улучшаем качество данных
         current_step += 1
@@ -682,17 +1279,10 @@ class ResearchBot:
             "📊 Обработка и фильтрация данных"
         )
         
-        # Удаляем дубликаты и низкокачественные результаты
-        unique_findings = []
-        seen_titles = set()
-        for finding in results['key_findings']:
-            title_lower = finding['title'].lower()
-            if title_lower not in seen_titles and len(finding['snippet']) > 30:
-                seen_titles.add(title_lower)
-                unique_findings.append(finding)
-        
-        results['key_findings'] = unique_findings[:25]  # Ограничиваем для лучшего качества
-        await asyncio.sleep(1)
+        # Дубликаты и короткие сниппеты уже отсеяны на вставке; в отчёт
+        # идут 25 самых релевантных теме находок с приоритетом разнообразия
+        # доменов — десять сниппетов с одного сайта дублируют друг друга
+        results['key_findings'] = self._rank_findings(results['key_findings'], k=25)
 
         # Генерация отчёта с помощью LLM
         current_step += 1
@@ -701,11 +1291,31 @@ class ResearchBot:
             "🧠 Генерация аналитического отчёта"
         )
         
-        try:
-            report_text = await asyncio.wait_for(
-                self.llm_generator.generate_report(results['key_findings'], topic),
-                timeout=self.llm_generator.per_request_timeout + 10
+        cache_key = _report_cache_key(topic, results['key_findings'])
+        cached = self._report_cache.get(cache_key)
+        if cached is not None and time.time() - cached[0] < REPORT_CACHE_TTL:
+            results['full_report_text'] = cached[1]
+            current_step += 1
+            await self._update_progress(
+                chat_id, progress_message_id, current_step, total_steps,
+                "📄 Подготовка итогового отчёта"
             )
+            return results
+
+        # LLM-вызов стартует сразу; пока он идёт, рендерим детерминированные
+        # секции отчёта — они не зависят от текста анализа
+        llm_task = asyncio.create_task(self._generate_report_chunked(results['key_findings'], topic))
+        try:
+            results['_static_md'] = await asyncio.to_thread(self._build_static_sections, results)
+            report_text = await llm_task
+            if len(self._report_cache) >= REPORT_CACHE_MAX:
+                # Вытесняем самую старую запись — кэш ограничен по размеру
+                oldest = min(self._report_cache, key=lambda k: self._report_cache[k][0])
+                del self._report_cache[oldest]
+            self._report_cache[cache_key] = (time.time(), report_text)
+        except asyncio.CancelledError:
+            llm_task.cancel()
+            raise
         except asyncio.TimeoutError:
             logger.warning("Timeout при генерации отчёта")
             report_text = "⚠️ Превышено время ожидания ответа от AI. Попробуйте позже или упростите тему."
@@ -721,62 +1331,89 @@ class ResearchBot:
             chat_id, progress_message_id, current_step, total_steps, 
             "📄 Подготовка итогового отчёта"
         )
-        await asyncio.sleep(0.5)
 
         return results
 
+    def _rank_findings(self, findings: List[dict], k: int = 25) -> List[dict]:
+        """Отбирает k находок для LLM: сначала лучшая с каждого нового домена,
+        затем добор по релевантности. nlargest-префильтр держит отбор
+        в O(n log 4k) вместо полной сортировки."""
+        ranked = heapq.nlargest(4 * k, findings, key=lambda kf: kf['_score'])
+        picked: List[dict] = []
+        overflow: List[dict] = []
+        seen_domains: set = set()
+        for kf in ranked:
+            domain = urlsplit(kf['link']).netloc
+            if domain not in seen_domains:
+                seen_domains.add(domain)
+                picked.append(kf)
+                if len(picked) == k:
+                    return picked
+            else:
+                overflow.append(kf)
+        picked.extend(overflow[:k - len(picked)])
+        return picked
+
+    async def _generate_report_chunked(self, key_findings: List[dict], topic: str) -> str:
+        """Map-reduce генерация отчёта: находки бьются на группы, частичные
+        отчёты запрашиваются у Mistral параллельно и сводятся финальным
+        вызовом. Один медленный запрос не держит весь пайплайн."""
+        llm = self.llm_generator
+        step_timeout = llm.per_request_timeout + 10
+
+        if len(key_findings) <= self.llm_chunk_size:
+            return await asyncio.wait_for(
+                llm.generate_report(key_findings, topic), timeout=step_timeout
+            )
+
+        sem = asyncio.Semaphore(self.llm_max_concurrent)
+
+        async def partial_report(chunk):
+            async with sem:
+                return await asyncio.wait_for(
+                    llm.generate_report(chunk, topic), timeout=step_timeout
+                )
+
+        chunks = [key_findings[i:i + self.llm_chunk_size]
+                  for i in range(0, len(key_findings), self.llm_chunk_size)]
+        partials = await asyncio.gather(*[partial_report(c) for c in chunks], return_exceptions=True)
+        good = [p for p in partials if isinstance(p, str)]
+        if not good:
+            raise next(p for p in partials if isinstance(p, BaseException))
+        if len(good) < len(partials):
+            logger.warning(f"Частичных отчётов потеряно: {len(partials) - len(good)} из {len(partials)}")
+        if len(good) == 1:
+            return good[0]
+        return await asyncio.wait_for(llm.merge_reports(good, topic), timeout=step_timeout)
+
     async def generate_search_queries(self, topic: str, settings: dict) -> List[str]:
         """Генерирует улучшенные поисковые запросы"""
-        base_queries = [
-            f"{topic} обзор 2025",
-            f"{topic} исследование анализ",
-            f"{topic} статистика данные тренды",
-            f"{topic} развитие перспективы",
-            f"{topic} проблемы вызовы решения",
-            f"{topic} инновации технологии",
-            f"{topic} рынок прогнозы",
-            f"{topic} экспертное мнение аналитика"
-        ]
-        
+        queries = [t.format(topic=topic) for t in BASE_QUERY_TEMPLATES]
+
         if settings.get('deep_analysis'):
-            deep_queries = [
-                f"{topic} case study практические примеры",
-                f"{topic} лучшие практики опыт",
-                f"{topic} исследования университетов",
-                f"{topic} отчёты консалтинговых компаний",
-                f"{topic} белые книги whitepaper",
-                f"{topic} научные публикации"
-            ]
-            base_queries.extend(deep_queries)
-        
+            queries.extend(t.format(topic=topic) for t in DEEP_QUERY_TEMPLATES)
+
         # Добавляем специфичные запросы в зависимости от темы
-        topic_lower = topic.lower()
-        if any(word in topic_lower for word in ['технология', 'tech', 'ии', 'ai', 'блокчейн', 'искусственный интеллект']):
-            base_queries.extend([
-                f"{topic} внедрение применение",
-                f"{topic} стартапы компании лидеры"
-            ])
-        elif any(word in topic_lower for word in ['медицина', 'здоровье', 'лечение']):
-            base_queries.extend([
-                f"{topic} клинические исследования",
-                f"{topic} эффективность результаты"
-            ])
-        elif any(word in topic_lower for word in ['экономика', 'финансы', 'бизнес']):
-            base_queries.extend([
-                f"{topic} экономический эффект",
-                f"{topic} инвестиции рынок"
-            ])
-        
-        return base_queries[:16]  # Ограничиваем количество запросов
+        tokens = set(_TOKEN_RE.findall(topic.lower()))
+        for keywords, templates in CATEGORY_QUERY_TEMPLATES:
+            if tokens & keywords:
+                queries.extend(t.format(topic=topic) for t in templates)
+                break
+
+        return queries[:16]  # Ограничиваем количество запросов
 
     async def _update_progress(self, chat_id: int, message_id: int, step: int, total: int, current_step_name: str):
         """Обновляет прогресс выполнения с улучшенной визуализацией"""
+        # Telegram ограничивает editMessageText примерно до одного в секунду
+        # на чат; промежуточные обновления коалесцируем, финальный шаг
+        # отправляется всегда.
+        metadata = self.active_researches.get(chat_id)
+        now = time.monotonic()
+        if step < total and now - self._last_edit.get(chat_id, 0.0) < 1.0:
+            return
+
         pct = min(100, int(step * 100 / max(1, total)))
-        
-        # Создаём красивый прогресс-бар
-        filled_blocks = int(pct / 5)
-        empty_blocks = 20 - filled_blocks
-        progress_bar = "🟩" * filled_blocks + "⬜" * empty_blocks
+        progress_bar = _PROGRESS_BARS[pct // 5]
         
         # Эмодзи для разных этапов
         if "Поиск" in current_step_name:
@@ -797,124 +1434,113 @@ class ResearchBot:
             f"{progress_bar}\n\n"
             f"⏱ <i>Примерное время: {max(1, (total-step)*15)} сек</i>"
         )
-        
-        try:
-            await self.application.bot.edit_message_text(
-                chat_id=chat_id, 
-                message_id=message_id, 
-                text=text, 
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            # Если не удалось отредактировать, отправляем новое сообщение
+
+        if metadata is not None:
+            if metadata.get('last_progress_text') == text:
+                return
+            metadata['last_progress_text'] = text
+
+        # Если предыдущая правка ещё в полёте, промежуточную просто роняем —
+        # финальный шаг дожидается своей очереди и уходит всегда
+        lock = self._edit_locks.setdefault(chat_id, asyncio.Lock())
+        if lock.locked() and step < total:
+            return
+
+        async with lock:
+            edit = self.application.bot.edit_message_text
             try:
-                await self.application.bot.send_message(
-                    chat_id=chat_id, 
-                    text=f"{emoji} {current_step_name} — {pct}%"
-                )
+                try:
+                    await edit(chat_id=chat_id, message_id=message_id, text=text, parse_mode='HTML')
+                except RetryAfter as e:
+                    # Flood control: ждём ровно сколько просит Telegram и
+                    # пробуем ещё раз
+                    await asyncio.sleep(e.retry_after)
+                    await edit(chat_id=chat_id, message_id=message_id, text=text, parse_mode='HTML')
+                # Отметка времени — только после успешной правки
+                self._last_edit[chat_id] = time.monotonic()
+            except BadRequest as e:
+                # «Message is not modified» — не ошибка, текст уже на месте;
+                # слать новое сообщение вместо правки не нужно
+                if 'not modified' in str(e).lower():
+                    return
+                logger.debug(f"Не удалось отредактировать прогресс: {e}")
             except Exception:
-                logger.debug("Не удалось отправить уведомление о прогрессе")
+                # Если не удалось отредактировать, отправляем новое сообщение
+                try:
+                    await self.application.bot.send_message(
+                        chat_id=chat_id,
+                        text=f"{emoji} {current_step_name} — {pct}%"
+                    )
+                except Exception:
+                    logger.debug("Не удалось отправить уведомление о прогрессе")
 
     def _build_report_markdown(self, results: dict) -> str:
         """Создаёт улучшенный Markdown отчёт"""
-        md = f"# 📊 Исследовательский отчёт: {results.get('topic','')}\n\n"
-        md += f"**📅 Дата создания:** {datetime.fromisoformat(results.get('timestamp')).strftime('%d.%m.%Y %H:%M')}\n"
-        md += f"**📊 Источников проанализировано:** {len(results.get('sources', []))}\n"
-        md += f"**🔍 Ключевых находок:** {len(results.get('key_findings', []))}\n\n"
-        
-        md += "---\n\n"
-        
+        # Сборка через список и один join: конкатенация md += ... в циклах
+        # квадратична по размеру отчёта
+        parts: List[str] = []
+        append = parts.append
+
+        # Инварианты циклов считаем один раз
+        sources = results.get('sources', [])
+        key_findings = results.get('key_findings', [])
+        sources_count = len(sources)
+        created = datetime.fromisoformat(results.get('timestamp')).strftime('%d.%m.%Y %H:%M')
+
+        append(f"# 📊 Исследовательский отчёт: {results.get('topic','')}\n\n")
+        append(f"**📅 Дата создания:** {created}\n")
+        append(f"**📊 Источников проанализировано:** {sources_count}\n")
+        append(f"**🔍 Ключевых находок:** {len(key_findings)}\n\n")
+
+        append(MD_SEP)
+
         # Основной отчёт от LLM
-        md += "## 🎯 Аналитический отчёт\n\n"
-        md += results.get('full_report_text', 'Отчёт не сгенерирован') + "\n\n"
-        
-        md += "---\n\n"
-        
-        # Ключевые находки с улучшенным форматированием
-        md += "## 🔍 Детальные находки\n\n"
-        for i, kf in enumerate(results.get('key_findings', [])[:20], start=1):
-            src_idx = kf.get('_source_index', i)
-            title = kf.get('title', 'Без названия')
-            snippet = kf.get('snippet', '')
-            
-            md += f"### {i}. {title}\n\n"
-            md += f"**Описание:** {snippet}\n\n"
-            md += f"**Источник:** [{src_idx}] {kf.get('link', '')}\n\n"
-            md += "---\n\n"
-        
+        append(MD_H_REPORT)
+        append(results.get('full_report_text', 'Отчёт не сгенерирован') + "\n\n")
+
+        append(MD_SEP)
+
+        # Детерминированные секции: берём предрассчитанные (рендерились
+        # параллельно с вызовом LLM) либо строим на месте
+        append(results.pop('_static_md', None) or self._build_static_sections(results))
+
+        return "".join(parts)
+
+    def _build_static_sections(self, results: dict) -> str:
+        """Секции отчёта, не зависящие от текста LLM (находки, источники,
+        мета) — их можно рендерить, пока Mistral генерирует анализ."""
+        parts: List[str] = []
+        append = parts.append
+
+        sources = results.get('sources', [])
+        key_findings = results.get('key_findings', [])
+        sources_count = len(sources)
+        now_s = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
+
+        # Ключевые находки (поля гарантированы при инджесте)
+        append(MD_H_FINDINGS)
+        for i, kf in enumerate(key_findings[:20], start=1):
+            append(f"### {i}. {kf['title']}\n\n")
+            append(f"**Описание:** {kf['snippet']}\n\n")
+            append(f"**Источник:** [{kf['_source_index']}] {kf['link']}\n\n")
+            append(MD_SEP)
+
         # Список источников
-        md += "## 📚 Источники\n\n"
-        for idx, s in enumerate(results.get('sources', []), start=1):
-            title = s.get('title', 'Без названия')
-            link = s.get('link', '')
-            md += f"{idx}. **{title}** \n   🔗 [{link}]({link})\n\n"
-        
+        append(MD_H_SOURCES)
+        for idx, s in enumerate(sources, start=1):
+            link = s['link']
+            append(f"{idx}. **{s['title']}** \n   🔗 [{link}]({link})\n\n")
+
         # Метаинформация
-        md += "---\n\n"
-        md += "## ℹ️ Информация о создании\n\n"
-        md += f"- **Поисковых запросов выполнено:** {len(results.get('searches', []))}\n"
-        md += f"- **Уникальных источников найдено:** {len(results.get('sources', []))}\n"
-        md += f"- **Время создания:** {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n"
-        md += f"- **Генератор:** Research Bot v2.0\n\n"
-        
-        return md
-
-    def _render_pdf_bytes(self, title: str, md_text: str) -> bytes:
-        """Создаёт улучшенный PDF с поддержкой кириллицы"""
-        from io import BytesIO
-        from reportlab.lib.styles import getSampleStyleSheet
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-        from reportlab.lib.units import inch
-        
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch)
-        
-        # Стили
-        styles = getSampleStyleSheet()
-        title_style = styles['Title']
-        heading_style = styles['Heading1']
-        normal_style = styles['Normal']
-        
-        # Устанавливаем шрифт с поддержкой кириллицы
-        if PDF_FONT_NAME and PDF_FONT_NAME != 'Helvetica':
-            try:
-                title_style.fontName = PDF_FONT_NAME
-                heading_style.fontName = PDF_FONT_NAME
-                normal_style.fontName = PDF_FONT_NAME
-            except Exception as e:
-                logger.warning(f"Не удалось установить шрифт {PDF_FONT_NAME}: {e}")
-        
-        story = []
-        
-        # Заголовок
-        story.append(Paragraph(f"Исследовательский отчёт: {title}", title_style))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Обрабатываем markdown текст
-        lines = md_text.split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line:
-                story.append(Spacer(1, 0.1*inch))
-            elif line.startswith('# '):
-                story.append(Paragraph(line[2:], title_style))
-            elif line.startswith('## '):
-                story.append(Paragraph(line[3:], heading_style))
-            elif line.startswith('### '):
-                story.append(Paragraph(line[4:], heading_style))
-            else:
-                # Убираем markdown разметку для PDF
-                clean_line = line.replace('**', '').replace('*', '').replace('`', '')
-                if len(clean_line) > 0:
-                    try:
-                        story.append(Paragraph(clean_line, normal_style))
-                    except Exception as e:
-                        # Если не удалось добавить строку, пропускаем её
-                        logger.debug(f"Пропущена строка в PDF: {e}")
-        
-        doc.build(story)
-        buffer.seek(0)
-        return buffer.read()
+        append(MD_SEP)
+        append(MD_H_META)
+        append(f"- **Поисковых запросов выполнено:** {len(results.get('searches', []))}\n")
+        append(f"- **Уникальных источников найдено:** {sources_count}\n")
+        append(f"- **Время создания:** {now_s}\n")
+        append(f"- **Генератор:** Research Bot v2.0\n\n")
+
+        return "".join(parts)
+
 
     # ---------- Run ----------
     def run(self):
@@ -928,7 +1554,31 @@ class ResearchBot:
             logger.error("❌ Отсутствует MISTRAL_API_KEY в переменных окружения")
             exit(1)
             
-        self.application = Application.builder().token(self.token).build()
+        # Расширенный пул HTTPX-клиента: параллельные исследования шлют
+        # edit_message_text/send_document одновременно, дефолтного пула не хватает
+        # Сессии клиентов создаются при старте event loop и закрываются на
+        # выходе — иначе keep-alive соединения повисают до таймаута ОС
+        async def _on_post_init(app):
+            await self.serper._ensure_session()
+            await self.llm_generator._ensure_session()
+
+        async def _on_post_shutdown(app):
+            await self.serper.close()
+            await self.llm_generator.close()
+
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .connection_pool_size(100)
+            .pool_timeout(10.0)
+            .connect_timeout(10.0)
+            .read_timeout(30.0)
+            .get_updates_connection_pool_size(16)
+            .get_updates_pool_timeout(30.0)
+            .post_init(_on_post_init)
+            .post_shutdown(_on_post_shutdown)
+            .build()
+        )
         
         # Добавляем обработчик ошибок
         async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -958,7 +1608,9 @@ class ResearchBot:
         logger.info("🚀 Research Bot v2.0 запущен успешно!")
         print("🚀 Research Bot v2.0 запущен! Нажмите Ctrl+C для остановки.")
         
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Подписываемся только на message: бот не обрабатывает другие типы
+        # апдейтов, а длинный poll без паузы убирает задержку между циклами
+        self.application.run_polling(allowed_updates=['message'], poll_interval=0.0, timeout=30)
 
 if __name__ == "__main__":
     required_vars = ['TELEGRAM_BOT_TOKEN', 'SERPER_API_KEY', 'MISTRAL_API_KEY']